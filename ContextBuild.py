@@ -5,13 +5,15 @@ import sublime_plugin
 import datetime
 import re
 import threading
-import time
 
+from failureIndex import FailureIndex
+from precompiler import Precompiler
 from runnerMocha import RunnerMocha
 from runnerNosetests import RunnerNosetests
 
 runners = [ RunnerNosetests, RunnerMocha ]
 options = sublime.load_settings('ContextBuild.sublime-settings')
+precompiler = Precompiler()
 
 class Build(object):
     last = None
@@ -24,26 +26,37 @@ class Build(object):
         self.lastView = None
         self.thread = None
         self.hasBuilt = False
+        self.failureIndex = None
+        # One of 'idle', 'queued' (waiting out the debounce), 'running', or
+        # 'cancelling' (stopping the running build, perhaps for a new one)
+        self.state = 'idle'
+        self._requested = False
+        self._pendingSetup = None
+        self._requestCount = 0
         self.runners = []
         for runner in runners:
             self.runners.append(runner(options, self))
 
 
     def abort(self):
-        while self.thread:
+        """Called in main thread; stop the running build, if any, and drop
+        any requested build.
+        """
+        self._requested = False
+        self._pendingSetup = None
+        if self.state == 'queued':
+            self.state = 'idle'
+        elif self.state == 'running':
             self.shouldStop = True
-            time.sleep(0.1)
+            self.state = 'cancelling'
 
 
     @classmethod
     def abortBuildForView(cls, viewId):
         with cls.lock:
             build = cls.viewIdToBuild.get(viewId)
-        # Release lock before aborting, since aborts require the lock.
-        # Also run it in a new thread to prevent "Slow plugin" warnings.
         if build:
-            t = threading.Thread(target = build.abort)
-            t.start()
+            build.abort()
 
 
     def getRunnerForPath(self, path):
@@ -55,12 +68,84 @@ class Build(object):
                 return r
 
 
-    def run(self):
-        """Called in main thread, do the build."""
-        if self.thread:
-            scheduler = threading.Thread(target = self._abortThenRun)
-            scheduler.start()
-            return
+    def run(self, setup = None):
+        """Called in main thread, request a build.  setup, if given, is called
+        in the main thread to set up the runners just before the build starts.
+
+        Requests are debounced by build_debounce_ms, and requests made before
+        the build starts are coalesced into the latest one (keeping the last
+        setup given).  A running build is cancelled, and the requested build
+        starts as soon as it finishes.
+        """
+        self._requested = True
+        if setup is not None:
+            self._pendingSetup = setup
+
+        if self.state == 'running':
+            self.shouldStop = True
+            self.state = 'cancelling'
+        elif self.state != 'cancelling':
+            self.state = 'queued'
+            self._requestCount += 1
+            requestCount = self._requestCount
+            sublime.set_timeout(lambda: self._startQueued(requestCount),
+                    options.get('build_debounce_ms', 0))
+
+
+    def setupTests(self, paths = [], tests = []):
+        madeView = None
+        if self.window.active_view() is None:
+            madeView = self.window.new_file()
+            madeView.set_scratch(True)
+
+        for r in self.runners:
+            r.setupTests(paths = paths, tests = tests)
+
+        if madeView is not None:
+            self.window.run_command("close")
+
+
+    def showFailure(self, location):
+        """Called in main thread; select the given failureIndex location in
+        the output pane and open its file at its line.
+        """
+        start, end, path, line = location
+        pane = self.lastView
+        if pane is not None and pane.window() is not None:
+            pane.sel().clear()
+            pane.sel().add(sublime.Region(start, end))
+            pane.show(start)
+        self.window.open_file("{0}:{1}".format(path, line),
+                sublime.ENCODED_POSITION)
+
+
+    def useFailures(self):
+        for r in self.runners:
+            r.useFailures()
+
+
+    def _start(self):
+        """Called in main thread, start the requested build.  If that fails
+        (e.g. setup raises), go back to idle so that the window can still
+        build.
+        """
+        try:
+            self._startBuild()
+        except Exception:
+            self._requested = False
+            self._pendingSetup = None
+            if self.thread is None:
+                self.state = 'idle'
+            raise
+
+
+    def _startBuild(self):
+        """Called in main thread by _start, do the build."""
+        setup = self._pendingSetup
+        self._pendingSetup = None
+        self._requested = False
+        if setup is not None:
+            setup()
 
         currentUserView = self.window.active_view()
 
@@ -97,6 +182,13 @@ class Build(object):
             self.outputPane = self.window.new_file()
         self.lastView = self.outputPane
         self.viewId = self.outputPane.id()
+        self.outputPane.erase_regions('context_build_failures')
+
+        getLocation = lambda line: None
+        for r in self.runners:
+            if r.isActive():
+                getLocation = r.getFailureLocation
+        self.failureIndex = FailureIndex(getLocation)
 
         now = datetime.datetime.now()
         timeStr = now.strftime("%I:%M:%S%p-%d-%m-%Y")
@@ -114,34 +206,23 @@ class Build(object):
         # runner to cache its options for the impending build.
         for r in self.runners:
             r.cacheOptionsForBuild()
+        # Views too; these are the files whose bytecode the build waits for
+        self._windowFiles = [ v.file_name() for v in self.window.views()
+                if v.file_name() is not None ]
 
         self.shouldStop = False
         self.thread = threading.Thread(target = self._realRun)
         self.thread.daemon = True
         self.thread.start()
-        
+        self.state = 'running'
 
-    def setupTests(self, paths = [], tests = []):
-        madeView = None
-        if self.window.active_view() is None:
-            madeView = self.window.new_file()
-            madeView.set_scratch(True)
 
-        for r in self.runners:
-            r.setupTests(paths = paths, tests = tests)
-
-        if madeView is not None:
-            self.window.run_command("close")
-
-
-    def useFailures(self):
-        for r in self.runners:
-            r.useFailures()
-
-
-    def _abortThenRun(self):
-        self.abort()
-        sublime.set_timeout(self.run, 0)
+    def _startQueued(self, requestCount):
+        """Debounce timer for run(); start the build if no request has come
+        in since.
+        """
+        if self.state == 'queued' and requestCount == self._requestCount:
+            self._start()
 
 
     def _realRun(self):
@@ -163,6 +244,10 @@ class Build(object):
         self.outputPane = None
         self.thread = None
         self.hasBuilt = True
+        if self.state == 'cancelling' and self._requested:
+            self._start()
+        else:
+            self.state = 'idle'
 
 
     def _coalesceOption(self, name, default = ''):
@@ -178,10 +263,17 @@ class Build(object):
 
     def _doBuild(self):
         """The main method for the build thread"""
+        # Let this window's files that are still being byte-compiled finish,
+        # so that the tests don't race to write the same bytecode.
+        precompiler.wait(self._windowFiles, self._shouldStop)
         for r in self.runners:
             r.runTests(self._writeOutput, self._shouldStop)
         def goToEnd():
             self.outputPane.show(self.outputPane.size())
+            self.outputPane.add_regions('context_build_failures',
+                    [ sublime.Region(l[0], l[1])
+                        for l in self.failureIndex.locations ],
+                    'invalid', sublime.DRAW_OUTLINED)
         sublime.set_timeout(goToEnd, 0)
 
 
@@ -192,15 +284,19 @@ class Build(object):
 
     def _writeOutput(self, text, end = '\n'):
         cat = text + end
+        failureIndex = self.failureIndex
         # Print in sublime's main thread to not cause buffer issues
         def realPrint():
             visibleRegion = self.outputPane.visible_region()
             shouldKeepInView = (visibleRegion.begin() <= self.outputPane.size() 
                     <= visibleRegion.end())
 
+            start = self.outputPane.size()
             edit = self.outputPane.begin_edit()
-            self.outputPane.insert(edit, self.outputPane.size(), cat)
+            self.outputPane.insert(edit, start, cat)
             self.outputPane.end_edit(edit)
+            # Index failures as they arrive, rather than searching the pane
+            failureIndex.feed(cat, start)
             
             if shouldKeepInView:
                 self.outputPane.show(self.outputPane.size())
@@ -208,7 +304,24 @@ class Build(object):
         sublime.set_timeout(realPrint, 0)
 
 
+def precompileFiles(view, files):
+    """Queue files for byte-compilation with the interpreter configured for
+    view's project.  Must be called in main thread.
+    """
+    settings = view.settings()
+    precompiler.compile(files,
+            settings.get('context_build_python',
+                options.get('context_build_python', 'python')),
+            settings.get('context_build_path',
+                options.get('context_build_path', '')))
+
+
 class ContextBuildPlugin(sublime_plugin.WindowCommand):
+    def hasFailureLocations(self):
+        failureIndex = self.build.failureIndex
+        return failureIndex is not None and len(failureIndex.locations) > 0
+
+
     def hasLastBuild(self):
         return self.build.hasBuilt
 
@@ -224,9 +337,8 @@ class ContextBuildPlugin(sublime_plugin.WindowCommand):
 
 class ContextBuildCurrentCommand(ContextBuildPlugin):
     def run(self):
-        self.build.setupTests(paths = [
-                self.window.active_view().file_name() ])
-        self.build.run()
+        path = self.window.active_view().file_name()
+        self.build.run(lambda: self.build.setupTests(paths = [ path ]))
 
 
     def is_enabled(self):
@@ -235,8 +347,7 @@ class ContextBuildCurrentCommand(ContextBuildPlugin):
 
 class ContextBuildSelectedCommand(ContextBuildPlugin):
     def run(self, paths = []):
-        self.build.setupTests(paths = paths)
-        self.build.run()
+        self.build.run(lambda: self.build.setupTests(paths = paths))
 
 
     def is_enabled(self):
@@ -257,8 +368,7 @@ class ContextBuildSelectionCommand(ContextBuildPlugin):
                 continue
             tests.setdefault(filePath, []).extend(newTests)
 
-        self.build.setupTests(tests = tests)
-        self.build.run()
+        self.build.run(lambda: self.build.setupTests(tests = tests))
 
 
 class ContextBuildLastCommand(ContextBuildPlugin):
@@ -272,8 +382,7 @@ class ContextBuildLastCommand(ContextBuildPlugin):
 
 class ContextBuildFailuresCommand(ContextBuildPlugin):
     def run(self):
-        self.build.useFailures()
-        self.build.run()
+        self.build.run(self.build.useFailures)
 
     def is_enabled(self):
         return self.hasLastBuild()
@@ -285,9 +394,48 @@ class ContextBuildStopCommand(ContextBuildPlugin):
 
 
     def is_enabled(self):
-        return self.hasLastBuild() and self.build.thread
+        return self.build.state != 'idle'
+
+
+class ContextBuildNextFailureCommand(ContextBuildPlugin):
+    def run(self):
+        self.build.showFailure(self.build.failureIndex.nextLocation())
+
+
+    def is_enabled(self):
+        return self.hasFailureLocations()
+
+
+class ContextBuildPreviousFailureCommand(ContextBuildPlugin):
+    def run(self):
+        self.build.showFailure(self.build.failureIndex.previousLocation())
+
+
+    def is_enabled(self):
+        return self.hasFailureLocations()
+
+
+class ContextBuildListFailuresCommand(ContextBuildPlugin):
+    def run(self):
+        failureIndex = self.build.failureIndex
+        items = [ "{0}:{1}".format(path, line)
+                for _start, _end, path, line in failureIndex.locations ]
+        def onDone(i):
+            if i >= 0:
+                self.build.showFailure(failureIndex.select(i))
+        self.window.show_quick_panel(items, onDone)
+
+
+    def is_enabled(self):
+        return self.hasFailureLocations()
 
 
 class ContextBuildViewClosedEvent(sublime_plugin.EventListener):
     def on_close(self, view):
         Build.abortBuildForView(view.id())
+
+
+class ContextBuildViewSavedEvent(sublime_plugin.EventListener):
+    def on_post_save(self, view):
+        if options.get('precompile_python') and view.file_name() is not None:
+            precompileFiles(view, [ view.file_name() ])
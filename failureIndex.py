@@ -0,0 +1,62 @@
+
+class FailureIndex(object):
+    """The failure locations (file:line) found in a build's output, along
+    with the output pane regions they were found in.  Output is scanned as it
+    is inserted, so that stepping between failures never rescans the pane.
+    """
+
+    def __init__(self, getLocation):
+        """getLocation -- Called with each line of output; returns
+                (path, lineNumber) if the line locates a failure, else None.
+        """
+        self.getLocation = getLocation
+        # (regionStart, regionEnd, path, lineNumber) in order of output
+        self.locations = []
+        self.current = -1
+        self._tail = u''
+        self._tailStart = 0
+
+
+    def feed(self, text, start):
+        """Scan text, which was just inserted in the pane at start.  Called in
+        main thread.  A trailing partial line is kept for the next call.
+        """
+        if isinstance(text, str):
+            # Regions count characters, not bytes
+            text = text.decode('utf-8', 'replace')
+        if not self._tail:
+            self._tailStart = start
+        lines = (self._tail + text).split(u'\n')
+        self._tail = lines.pop()
+        lineStart = self._tailStart
+        for line in lines:
+            location = self.getLocation(line)
+            if location is not None:
+                self.locations.append((lineStart, lineStart + len(line))
+                        + tuple(location))
+            lineStart += len(line) + 1
+        self._tailStart = lineStart
+
+
+    def nextLocation(self):
+        """Return the location after the current one, wrapping around, or None
+        if there are no locations.
+        """
+        if not self.locations:
+            return None
+        return self.select((self.current + 1) % len(self.locations))
+
+
+    def previousLocation(self):
+        """Return the location before the current one, wrapping around, or
+        None if there are no locations.
+        """
+        if not self.locations:
+            return None
+        return self.select((self.current - 1) % len(self.locations))
+
+
+    def select(self, i):
+        """Make location i current and return it."""
+        self.current = i
+        return self.locations[i]
@@ -0,0 +1,116 @@
+// Passed to mocha in place of each of the mocha_compilers when
+// mocha_compile_cache is enabled.  Loads the real compilers from
+// CONTEXT_BUILD_MOCHA_COMPILERS and caches their output on disk, keyed by
+// the source's path and content and the compiler's version, so that only
+// changed files are recompiled.  The cache is trimmed to
+// CONTEXT_BUILD_MOCHA_CACHE_SIZE bytes, least recently used first.
+var crypto = require('crypto');
+var fs = require('fs');
+var Module = require('module');
+var path = require('path');
+
+var cacheDir = process.env.CONTEXT_BUILD_MOCHA_CACHE_DIR;
+var cacheSize = parseInt(process.env.CONTEXT_BUILD_MOCHA_CACHE_SIZE, 10);
+
+function mkdirs(dir) {
+    if (!fs.existsSync(dir)) {
+        mkdirs(path.dirname(dir));
+        fs.mkdirSync(dir);
+    }
+}
+
+function compilerVersion(filename, sources) {
+    // The version from the compiler's package.json, if any, plus a hash of
+    // every file it loaded, so that editing a compiler under development
+    // invalidates its output too.
+    var hash = crypto.createHash('sha1').update(filename);
+    var dir = path.dirname(filename);
+    while (true) {
+        var pkg = path.join(dir, 'package.json');
+        if (fs.existsSync(pkg)) {
+            var info = JSON.parse(fs.readFileSync(pkg, 'utf8'));
+            hash.update('@' + info.version);
+            break;
+        }
+        if (path.dirname(dir) === dir) {
+            break;
+        }
+        dir = path.dirname(dir);
+    }
+    sources.sort().forEach(function(source) {
+        hash.update('\0' + source + '\0').update(fs.readFileSync(source));
+    });
+    return hash.digest('hex');
+}
+
+function cacheExtension(ext, version) {
+    var compile = require.extensions[ext];
+    require.extensions[ext] = function(module, filename) {
+        var source = fs.readFileSync(filename, 'utf8');
+        // Output may depend on the path (source maps, coverage, etc.)
+        var key = crypto.createHash('sha1').update(version).update('\0')
+                .update(filename).update('\0').update(source).digest('hex');
+        var cached = path.join(cacheDir, key + '.js');
+        if (fs.existsSync(cached)) {
+            // Touch for LRU eviction
+            var now = new Date();
+            fs.utimesSync(cached, now, now);
+            return module._compile(fs.readFileSync(cached, 'utf8'), filename);
+        }
+
+        var realCompile = module._compile;
+        module._compile = function(content, compiledFilename) {
+            module._compile = realCompile;
+            var tmp = cached + '.' + process.pid;
+            fs.writeFileSync(tmp, content);
+            fs.renameSync(tmp, cached);
+            return realCompile.call(module, content, compiledFilename);
+        };
+        return compile(module, filename);
+    };
+}
+
+function evict() {
+    try {
+        var entries = fs.readdirSync(cacheDir).filter(function(name) {
+            // Skip other processes' in-flight writes
+            return /^[0-9a-f]+\.js$/.test(name);
+        }).map(function(name) {
+            var file = path.join(cacheDir, name);
+            return { file: file, stat: fs.statSync(file) };
+        });
+        var total = 0;
+        entries.forEach(function(e) { total += e.stat.size; });
+        entries.sort(function(a, b) { return a.stat.mtime - b.stat.mtime; });
+        for (var i = 0; i < entries.length && total > cacheSize; i++) {
+            fs.unlinkSync(entries[i].file);
+            total -= entries[i].stat.size;
+        }
+    }
+    catch (e) {
+        // Another build is trimming the cache too; leave it to them
+    }
+}
+
+mkdirs(cacheDir);
+process.env.CONTEXT_BUILD_MOCHA_COMPILERS.split(',').forEach(function(c) {
+    // Same format and resolution as mocha's own --compilers
+    var parts = c.split(':');
+    var ext = parts.shift();
+    var mod = parts.join(':');
+    if (mod[0] === '.') {
+        mod = path.join(process.cwd(), mod);
+    }
+    var filename = Module._resolveFilename(mod, require.main);
+    var loaded = Object.keys(require.cache);
+    require(filename);
+    var sources = Object.keys(require.cache).filter(function(source) {
+        return loaded.indexOf(source) < 0;
+    });
+    if (sources.indexOf(filename) < 0) {
+        // Already loaded, e.g. by an earlier extension
+        sources.push(filename);
+    }
+    cacheExtension('.' + ext, compilerVersion(filename, sources));
+});
+process.on('exit', evict);
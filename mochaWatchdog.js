@@ -0,0 +1,6 @@
+// Loaded ahead of the test files when context_build_test_timeout is set, so
+// that ContextBuild's watchdog knows which test is running.  TAP treats lines
+// starting with "#" as comments.
+beforeEach(function() {
+    console.log("# context_build_start " + this.currentTest.fullTitle());
+});
@@ -0,0 +1,90 @@
+
+import os
+import shlex
+import subprocess
+import threading
+
+class Precompiler(object):
+    """Byte-compiles saved Python files in a background thread, using the
+    project's interpreter so that the bytecode lands where its test processes
+    will look for it.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        # (python, PATH) : set of files waiting to be compiled
+        self._pending = {}
+        # Files being compiled right now
+        self._compiling = set()
+        self._thread = None
+
+
+    def compile(self, files, python, path):
+        """Queue files for compilation with the interpreter python, found on
+        path.  May be called from any thread.
+        """
+        files = [ f for f in files if f.endswith('.py') ]
+        if not files:
+            return
+        with self._cond:
+            self._pending.setdefault((python, path), set()).update(files)
+            if self._thread is None:
+                self._thread = threading.Thread(target = self._run)
+                self._thread.daemon = True
+                self._thread.start()
+            self._cond.notify_all()
+
+
+    def wait(self, files, shouldStop):
+        """Block until those of files that are queued or compiling have been
+        compiled, or shouldStop() returns True.  Other files in the queue,
+        e.g. from other windows, are not waited for.
+        """
+        files = set(files)
+        with self._cond:
+            while self._isInFlight(files) and not shouldStop():
+                self._cond.wait(0.1)
+
+
+    def _compileFiles(self, python, path, files):
+        # compileall skips files whose bytecode is already up to date, so
+        # queueing a file twice is cheap.
+        files = [ f for f in files if os.path.isfile(f) ]
+        if not files:
+            return
+        env = os.environ.copy()
+        env['PATH'] = path + ':' + env['PATH']
+        with open(os.devnull, 'w') as devnull:
+            try:
+                subprocess.call(shlex.split(str(python))
+                        + [ '-m', 'compileall', '-q' ] + files, env = env,
+                        stdout = devnull, stderr = subprocess.STDOUT)
+            except OSError:
+                # Interpreter not found; the test run will say so
+                pass
+
+
+    def _isInFlight(self, files):
+        """Must hold self._cond."""
+        if files & self._compiling:
+            return True
+        for pending in self._pending.values():
+            if files & pending:
+                return True
+        return False
+
+
+    def _run(self):
+        """The main method for the compile thread"""
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                (python, path), files = self._pending.popitem()
+                self._compiling = files
+            try:
+                self._compileFiles(python, path, sorted(files))
+            finally:
+                with self._cond:
+                    self._compiling = set()
+                    self._cond.notify_all()
@@ -1,6 +1,7 @@
 
 import os
 import shlex
+import signal
 import subprocess
 import tempfile
 import threading
@@ -10,7 +11,8 @@ import time
 # know what settings we're interested in collapsing from the project settings.
 # (We have to know because options can only be fetched on the main thread)
 buildSettings = [ "context_build_path", "context_build_python_path",
-        "context_build_runner" ]
+        "context_build_runner", "context_build_test_timeout",
+        "context_build_timeout" ]
 
 class RunnerBase(object):
     """A class to run a certain type of tests and populate self.failed with
@@ -22,10 +24,21 @@ class RunnerBase(object):
             implementation of getTestsFromRegion, which requires
             _findTestFromLine to be implemented in the subclass."""
 
+    _FAILURE_LOCATION_REGEX = None
+    _FAILURE_LOCATION_REGEX_doc = """Specify as a regex (re.compile) whose
+            first two groups are the path and line number in a line of output
+            that locates a failure, for getFailureLocation."""
+    _LIBRARY_PATHS = ()
+    _LIBRARY_PATHS_doc = """Path components of installed libraries, whose
+            locations getFailureLocation leaves out."""
+
     def __init__(self, options, build):
         self.options = options
         self.build = build
         self.failures = {}
+        self._currentTest = None
+        self._timedOutTest = None
+        self._buildTimedOut = False
 
 
     @property
@@ -40,6 +53,25 @@ class RunnerBase(object):
         """
 
 
+    def getFailureLocation(self, line):
+        """Return (path, lineNumber) if line, as written to the output pane,
+        points at the source of a failure in the project, else None.  Called
+        in main thread for each line of output.
+        """
+        if self._FAILURE_LOCATION_REGEX is None:
+            return None
+        m = self._FAILURE_LOCATION_REGEX.match(line.rstrip())
+        if m is None:
+            return None
+        path = m.group(1)
+        if not os.path.isabs(path):
+            return None
+        for libraryPath in self._LIBRARY_PATHS:
+            if libraryPath in path:
+                return None
+        return (path, int(m.group(2)))
+
+
     def getTestsFromRegion(self, viewText, start, end):
         """Implement in subclass to get a list of tests (input into setupTests)
         to run based on the region from start to end in viewText.
@@ -72,6 +104,12 @@ class RunnerBase(object):
         return tests
 
 
+    def isActive(self):
+        """Return True if this runner runs the tests set up by setupTests."""
+        return ('Runner' + self.settings['context_build_runner'].title()
+                == self.__class__.__name__)
+
+
     def runTests(self, writeOutput, shouldStop):
         """Run the tests; this is called in a thread other than the main one.
         Any long-running operations should use shouldStop() to determine
@@ -80,11 +118,12 @@ class RunnerBase(object):
         writeOutput can be used to write output directly to the build pane.
         """
         self.failures = {}
-        if ('Runner' + self.settings['context_build_runner'].title()
-                != self.__class__.__name__):
+        if not self.isActive():
             return
         self.writeOutput = writeOutput
         self._shouldStop = shouldStop
+        self._buildStart = time.time()
+        self._buildTimedOut = False
         self.doRunner(writeOutput, shouldStop)
 
 
@@ -110,6 +149,25 @@ class RunnerBase(object):
         self.setupTests(tests = self.failures)
 
 
+    def _checkTimeouts(self):
+        """Called from _runProcess while the child runs; returns a message
+        describing the exceeded timeout, or None if we are within budget.
+        Timeouts are in seconds; 0 or empty disables them.
+        """
+        now = time.time()
+        buildTimeout = self.settings['context_build_timeout']
+        if buildTimeout and now - self._buildStart > buildTimeout:
+            self._buildTimedOut = True
+            return "Build exceeded timeout of {0}s".format(buildTimeout)
+
+        testTimeout = self.settings['context_build_test_timeout']
+        if (testTimeout and self._currentTest is not None
+                and now - self._currentTestStart > testTimeout):
+            return "Test {0} exceeded timeout of {1}s".format(
+                    self._currentTest, testTimeout)
+        return None
+
+
     def _coalesceOption(self, name, default = ''):
         """We want to use the project's overloaded settings if they're
         available for things like paths, but default to sane defaults
@@ -130,7 +188,14 @@ class RunnerBase(object):
             except IOError:
                 pass
             time.sleep(0.1)
-        outputCallback(p.stdout.read())
+        # The rest of p's process group may close the pipe a moment after p
+        # exits, so wait briefly for end of file.
+        for _ in range(10):
+            try:
+                outputCallback(p.stdout.read())
+                break
+            except IOError:
+                time.sleep(0.1)
 
 
     def _escapePaths(self, paths):
@@ -150,6 +215,32 @@ class RunnerBase(object):
         raise NotImplementedError()
 
 
+    def _getResumeCmd(self, timedOutTest):
+        """Override in subclass to return the command that runs the tests
+        remaining after timedOutTest was killed, or None if the runner
+        cannot resume.
+        """
+        return None
+
+
+    def _killProcess(self, p, force):
+        """Send SIGTERM, or SIGKILL if force, to p's process group, or just
+        to p where process groups are unavailable.
+        """
+        if hasattr(os, 'killpg'):
+            os.killpg(p.pid, signal.SIGKILL if force else signal.SIGTERM)
+        elif force:
+            p.kill()
+        else:
+            p.terminate()
+
+
+    def _recordTimeout(self, timedOutTest, message):
+        """Override in subclass to record timedOutTest as a failure in
+        self.failures.
+        """
+
+
     def _runProcess(self, cmd, echoStdout = True, **kwargs):
         """Run a command through subprocess.Popen and optionally spit all
         of the output to our output pane.  Checks shouldStop throughout
@@ -172,6 +263,10 @@ class RunnerBase(object):
         else:
             defaultKwargs['stdout'] = tempfile.TemporaryFile()
         defaultKwargs['stderr'] = subprocess.STDOUT
+        if hasattr(os, 'setsid'):
+            # Own process group, so that stopping the tests also stops any
+            # processes they spawned (e.g. mocha's _mocha)
+            defaultKwargs['preexec_fn'] = os.setsid
         defaultKwargs.update(kwargs)
 
         env = os.environ.copy()
@@ -179,6 +274,9 @@ class RunnerBase(object):
         env.update(defaultKwargs.get('env', {}))
         defaultKwargs['env'] = env
 
+        self._currentTest = None
+        self._timedOutTest = None
+        timeoutMessage = None
         p = subprocess.Popen(shlex.split(cmd), **defaultKwargs)
         if echoStdout:
             try:
@@ -198,13 +296,23 @@ class RunnerBase(object):
         while p.poll() is None:
             if self._shouldStop():
                 break
+            timeoutMessage = self._checkTimeouts()
+            if timeoutMessage is not None:
+                self._timedOutTest = self._currentTest
+                self._timeoutMessage = timeoutMessage
+                break
             time.sleep(0.1)
         if p.poll() is None:
-            # Exited due to shouldStop
-            self.writeOutput("\n\nAborting tests...")
+            # Exited due to shouldStop or the watchdog
+            if timeoutMessage is not None:
+                self.writeOutput("\n\n{0}, killing tests...".format(
+                        timeoutMessage))
+            else:
+                self.writeOutput("\n\nAborting tests...")
             while p.poll() is None:
                 try:
-                    p.terminate()
+                    # Hung tests may well ignore SIGTERM
+                    self._killProcess(p, timeoutMessage is not None)
                 except OSError:
                     # Died already
                     pass
@@ -218,3 +326,43 @@ class RunnerBase(object):
             tf = defaultKwargs['stdout']
             tf.seek(0)
             return tf
+
+
+    def _runWatchedProcess(self, cmd, **kwargs):
+        """Run cmd through _runProcess under the watchdog.  When a test is
+        killed for exceeding context_build_test_timeout, it is recorded via
+        _recordTimeout and the remaining tests are resumed with the command
+        from _getResumeCmd, until the tests finish, the build times out, or
+        the runner cannot resume.
+        """
+        while True:
+            self._runProcess(cmd, **kwargs)
+            if self._timedOutTest is not None:
+                self._recordTimeout(self._timedOutTest, self._timeoutMessage)
+            if self._buildTimedOut:
+                self.writeOutput("\nBuild timed out; remaining tests were "
+                        "not run.")
+                return
+            if self._timedOutTest is None or self._shouldStop():
+                return
+
+            cmd = self._getResumeCmd(self._timedOutTest)
+            if cmd is None:
+                self.writeOutput("\nNo remaining tests to resume.")
+                return
+            self.writeOutput("\nResuming remaining tests: " + cmd)
+
+
+    def _testFinished(self):
+        """Called by subclasses from their output callbacks when the running
+        test has reported a result.
+        """
+        self._currentTest = None
+
+
+    def _testStarted(self, test):
+        """Called by subclasses from their output callbacks when test starts
+        running, so that the watchdog can time it.
+        """
+        self._currentTestStart = time.time()
+        self._currentTest = test
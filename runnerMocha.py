@@ -1,5 +1,7 @@
 
+import os
 import re
+import tempfile
 
 from runnerBase import RunnerBase
 
@@ -13,9 +15,20 @@ class RunnerMocha(RunnerBase):
     _HEADER_LINE = re.compile(r"^\d+\.\.\d+$", re.M)
     _ERROR_LINE = re.compile(r"^  [a-zA-Z0-9]*Error:.*$")
     _ERROR_CONTINUE_LINE = re.compile(r"^ +at .*:\d+:\d+\)?$")
+    _FAILURE_LOCATION_REGEX = re.compile(r"^ +at (?:.*\()?(.+):(\d+):\d+\)?$")
+    _LIBRARY_PATHS = ( "/node_modules/", )
+    _WATCHDOG_LINE = re.compile(r"^# context_build_start (.*)$")
+    _WATCHDOG_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+            "mochaWatchdog.js")
+    _COMPILE_CACHE_SCRIPT = os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), "mochaCompileCache.js")
 
     def cacheOptionsForBuild(self):
         self._mochaCompilers = self.options.get('mocha_compilers', '')
+        self._mochaCompileCache = self.options.get('mocha_compile_cache',
+                True)
+        self._mochaCompileCacheMb = self.options.get('mocha_compile_cache_mb',
+                64)
 
 
     def doRunner(self, writeOutput, shouldStop):
@@ -25,22 +38,40 @@ class RunnerMocha(RunnerBase):
         # mocha_compilers is a system-wide setting, not a project setting,
         # se we get it from options rather than settings.
         compilers = self._mochaCompilers
+        env = {}
+        if compilers and self._mochaCompileCache:
+            # Have mocha load our caching wrapper, which loads the real
+            # compilers itself.
+            env = {
+                'CONTEXT_BUILD_MOCHA_COMPILERS': ','.join(compilers),
+                'CONTEXT_BUILD_MOCHA_CACHE_DIR': os.path.join(
+                        tempfile.gettempdir(), "context-build-mocha-cache"),
+                'CONTEXT_BUILD_MOCHA_CACHE_SIZE': str(
+                        int(self._mochaCompileCacheMb * 1024 * 1024)),
+            }
+            compilers = [ c.split(':', 1)[0] + ':' + self._COMPILE_CACHE_SCRIPT
+                    for c in compilers ]
         if compilers:
-            mochaOptions += ' --compilers '
-            mochaOptions += ','.join(compilers)
+            # Quoted, since paths like our wrapper's may contain spaces
+            mochaOptions += ' --compilers'
+            mochaOptions += self._escapePaths([ ','.join(compilers) ])
+        if self.settings['context_build_test_timeout']:
+            # Have mocha tell us when each test starts
+            mochaOptions += self._escapePaths([ self._WATCHDOG_SCRIPT ])
+        self._mochaOptions = mochaOptions
 
         realCmd = realCmd.replace("{mocha_options}", mochaOptions)
 
         writeOutput("Running tests: " + realCmd)
-        self._nextTestLines = None  # Set to None before the header line
         self._lastTest = -1
+        self._testIdOffset = 0
         self._tests = {}
         self._countOk = 0
         self._countFailed = 0
-        self._inError = False
-        self._allOutput = ""
+        self._startProcessOutput()
         # Use first failure as paths storage
-        self._runProcess(realCmd, echoStdout = self._processOutput)
+        self._runWatchedProcess(realCmd, echoStdout = self._processOutput,
+                env = env)
 
         self.writeOutput('')
         self.writeOutput("=" * 80)
@@ -57,12 +88,13 @@ class RunnerMocha(RunnerBase):
 
 
     def runnerSetup(self, paths = [], tests = {}):
-        cmd = "mocha --reporter tap{mocha_options} "
+        cmd = self._getBaseCmd()
 
         if paths:
             cmd += self._escapePaths(paths)
             # Remember our paths, since we re-use them for failed tests.
             self._paths = paths
+            self._testNames = None
         elif tests:
             # Mocha doesn't tell us which paths contain which tests, so just
             # keep a set of paths and add them to our cmd as we go
@@ -74,14 +106,14 @@ class RunnerMocha(RunnerBase):
                     testNames.add(ts)
 
             cmd += self._escapePaths(paths)
-            cmd += ' --grep "^'
-            cmd += '$|^'.join(testNames)
-            cmd += '$"'
+            cmd += self._grepOption(testNames)
             # and keep _paths the same as it was in tests
             self._paths = list(paths)
+            self._testNames = list(testNames)
         else:
             cmd = "echo 'No tests to run.'"
             self._paths = []
+            self._testNames = None
 
         self.cmd = cmd
 
@@ -100,6 +132,44 @@ class RunnerMocha(RunnerBase):
         return testName
 
 
+    def _getBaseCmd(self):
+        return "mocha --reporter tap{mocha_options}"
+
+
+    def _getResumeCmd(self, timedOutTest):
+        """Re-run the selected tests that have not reported yet; mocha
+        numbers its TAP output from 1 again, so continue our ids from the
+        timed out test.
+        """
+        done = set([ t['fullTitle'] for t in self._tests.values() ])
+        if self._testNames is not None:
+            remaining = [ t for t in self._testNames if t not in done ]
+            if not remaining:
+                return None
+            grep = self._grepOption(remaining)
+        else:
+            grep = self._grepOption(done, invert = True)
+
+        self._testIdOffset = self._lastTest
+        self._startProcessOutput()
+        return (self._getBaseCmd().replace("{mocha_options}",
+                self._mochaOptions) + self._escapePaths(self._paths) + grep)
+
+
+    def _grepOption(self, testNames, invert = False):
+        """Return a --grep option matching exactly the given full test titles.
+        """
+        escaped = []
+        for t in testNames:
+            regex = re.sub(r'([\\^$.|?*+()\[\]{}])', r'\\\1', t)
+            # Inside double quotes, shlex.split only unescapes \\ and \"
+            escaped.append(regex.replace('\\', '\\\\').replace('"', '\\"'))
+        grep = ' --grep "^' + '$|^'.join(escaped) + '$"'
+        if invert:
+            grep += ' --invert'
+        return grep
+
+
     def _processLine(self, line):
         if self._inError:
             if self._ERROR_CONTINUE_LINE.match(line.rstrip()):
@@ -108,6 +178,12 @@ class RunnerMocha(RunnerBase):
             # No longer reading error lines, leave this mode
             self._inError = False
 
+        watchdogMatch = self._WATCHDOG_LINE.match(line.rstrip())
+        if watchdogMatch:
+            self._startedTitle = watchdogMatch.group(1)
+            self._testStarted(self._startedTitle)
+            return
+
         if self._nextTestLines is None:
             # Looking for header line or initialization errors
             if self._HEADER_LINE.match(line.strip()):
@@ -119,26 +195,32 @@ class RunnerMocha(RunnerBase):
                 self.writeOutput(line.rstrip())
         elif line.startswith('ok '):
             _, testId, text = line.split(' ', 2)
+            testId = int(testId) + self._testIdOffset
             if testId == self._lastTest:
                 return
             self._lastTest = testId
             self._tests[testId] = { 'test': text.strip(), 'ok': True,
+                    'fullTitle': self._takeFullTitle(text),
                     'lines': self._nextTestLines, 'errorLines': [] }
             self._nextTestLines = []
             self._countOk += 1
+            self._testFinished()
             self.writeOutput('.', end = '')
         elif line.startswith('not ok '):
             _, _, testId, text = line.split(' ', 3)
+            testId = int(testId) + self._testIdOffset
             if testId == self._lastTest:
                 return
             self._lastTest = testId
             self._tests[testId] = { 'test': text.strip(), 'ok': False,
+                    'fullTitle': self._takeFullTitle(text),
                     'errorLines': self._nextTestLines }
             self._nextTestLines = []
             self._countFailed += 1
             # Mocha doesn't tell us which file a test came from... so....
             for f in self._paths:
                 self.failures.setdefault(f, []).append(text.strip())
+            self._testFinished()
             self.writeOutput('E', end = '')
         elif self._ERROR_LINE.match(line.rstrip()):
             self._tests[self._lastTest]['errorLines'].append(line.rstrip())
@@ -156,3 +238,31 @@ class RunnerMocha(RunnerBase):
                 break
             self._processLine(parts[0] + '\n')
             self._allOutput = parts[1]
+
+
+    def _recordTimeout(self, timedOutTest, message):
+        self._lastTest += 1
+        errorLines = (self._nextTestLines or []) + [ '  ' + message ]
+        self._tests[self._lastTest] = { 'test': timedOutTest, 'ok': False,
+                'fullTitle': timedOutTest, 'errorLines': errorLines }
+        self._countFailed += 1
+        for f in self._paths:
+            self.failures.setdefault(f, []).append(timedOutTest)
+
+
+    def _startProcessOutput(self):
+        """Reset our TAP parsing state for a new mocha process."""
+        self._nextTestLines = None  # Set to None before the header line
+        self._inError = False
+        self._allOutput = ""
+        self._startedTitle = None
+
+
+    def _takeFullTitle(self, text):
+        """Return the full title of the test that just reported as text.  The
+        TAP reporter drops "#" from titles, so prefer the watchdog's title,
+        which is what --grep and _testNames match against.
+        """
+        fullTitle = self._startedTitle or text.strip()
+        self._startedTitle = None
+        return fullTitle
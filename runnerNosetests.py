@@ -9,6 +9,22 @@ from runnerBase import RunnerBase
 class RunnerNosetests(RunnerBase):
 
     _TEST_REGEX = re.compile("^([ \t]*)def (test[^( ]*)", re.M)
+    _FAILURE_LOCATION_REGEX = re.compile(r'^ +File "(.+)", line (\d+)')
+    # The standard library (lib/pythonX.Y), installed packages, and Debian's
+    # older homes for them
+    _LIBRARY_PATHS = ( "/lib/python2", "/lib/python3", "/lib64/python2",
+            "/lib64/python3", "/site-packages/", "/dist-packages/",
+            "/usr/share/pyshared/", "/usr/lib/pymodules/" )
+    # Verbose (-v) output of a test; nose prefixes it with the test id, or
+    # spaces for a test it has already numbered.
+    _VERBOSE_PREFIX = re.compile(r"^(?:#\d+ +| +)")
+    _VERBOSE_START = re.compile(r"^(.*) \.\.\. $")
+    # Every result unittest and nose report; only FAIL and ERROR are failures
+    _VERBOSE_RESULT = re.compile(r"^(.*) \.\.\. (ok|FAIL|ERROR|SKIP.*"
+            r"|skipped.*|DEPRECATED|expected failure|unexpected success)$")
+    _VERBOSE_FAILURE = re.compile(r" \.\.\. (FAIL|ERROR)$")
+    _VERBOSE_METHOD = re.compile(r"^(\w+) \(([\w.]+)\.(\w+)\)$")
+    _VERBOSE_FUNCTION = re.compile(r"^([\w.]+)\.(\w+)(?:\(.*\))?$")
 
     def cacheOptionsForBuild(self):
         self._nosetestsArgs = self.options.get('nosetests_args', '')
@@ -20,11 +36,16 @@ class RunnerNosetests(RunnerBase):
         if nosetestsArgs:
             # Must have preceding space
             nosetestsArgs = ' ' + nosetestsArgs
+        if self.settings['context_build_test_timeout']:
+            # Verbose output tells the watchdog which test is running
+            nosetestsArgs += ' -v'
+        self._realNosetestsArgs = nosetestsArgs
         realCmd = realCmd.replace("{nosetests_args}", nosetestsArgs)
         writeOutput("Running tests: " + realCmd)
-        self._runProcess(realCmd, echoStdout = True,
-                env = { 'PYTHONPATH':
-                        self.settings['context_build_python_path']})
+        self._startProcessOutput()
+        self._removeIdsFile()
+        self._runWatchedProcess(realCmd, echoStdout = self._processOutput,
+                env = self._getEnv())
 
         # Read nose output to see what failed
         try:
@@ -33,20 +54,17 @@ class RunnerNosetests(RunnerBase):
             for failId in fails['failed']:
                 fpath, _module, testspec = fails['ids'][int(failId)]
                 self.failures.setdefault(fpath, []).append(testspec)
-            os.remove(self._noseIdsFile)
         except IOError:
             pass
+        self._removeIdsFile()
 
 
     def runnerSetup(self, paths = [], tests = {}):
         """Build our command line based on the given paths and tests.
         """
-        # We need --with-ids to generate the .noseids file
-        cmd = "nosetests --with-id --id-file="
         self._noseIdsFile = os.path.join(tempfile.gettempdir(),
                 "context-build-nose-ids")
-        cmd += self._noseIdsFile
-        cmd += "{nosetests_args}"
+        cmd = self._getBaseCmd()
 
         if paths:
             cmd += self._escapePaths(paths)
@@ -80,3 +98,141 @@ class RunnerNosetests(RunnerBase):
                 return (text[clsIndent + len('class '):] + '.'
                         + testName)
         return None
+
+
+    def _getBaseCmd(self):
+        # We need --with-ids to generate the .noseids file
+        cmd = "nosetests --with-id --id-file="
+        cmd += self._noseIdsFile
+        cmd += "{nosetests_args}"
+        return cmd
+
+
+    def _getEnv(self):
+        return { 'PYTHONPATH': self.settings['context_build_python_path'] }
+
+
+    def _getResumeCmd(self, timedOutTest):
+        """Nose cannot skip tests it has already run, so collect the tests
+        for our original command and resume with those that come after
+        timedOutTest.
+        """
+        collectCmd = self.cmd.replace("{nosetests_args}",
+                self._realNosetestsArgs + " --collect-only")
+        collected = self._runProcess(collectCmd, echoStdout = False,
+                env = self._getEnv())
+        tests = []
+        lastLine = None
+        for line in collected.read().split('\n'):
+            result = self._parseVerboseLine(self._VERBOSE_RESULT, line,
+                    lastLine)
+            if result is not None:
+                tests.append(result)
+            lastLine = line
+
+        if timedOutTest not in tests:
+            return None
+        addresses = []
+        for test in tests[tests.index(timedOutTest) + 1:]:
+            testAddress = self._getTestAddress(test)
+            if testAddress is None:
+                self.writeOutput("Cannot resume test: " + test)
+                continue
+            address = ':'.join(testAddress)
+            if address not in addresses:
+                addresses.append(address)
+        if not addresses:
+            return None
+
+        self._startProcessOutput()
+        self._removeIdsFile()
+        return (self._getBaseCmd().replace("{nosetests_args}",
+                self._realNosetestsArgs) + ' ' + ' '.join(addresses))
+
+
+    def _getTestAddress(self, test):
+        """Return (module, testspec) for a verbose test description, or None
+        if nose would not accept it as a test name.
+        """
+        m = self._VERBOSE_METHOD.match(test)
+        if m:
+            return (m.group(2), m.group(3) + '.' + m.group(1))
+        m = self._VERBOSE_FUNCTION.match(test)
+        if m:
+            return (m.group(1), m.group(2))
+        return None
+
+
+    def _parseVerboseLine(self, regex, line, lastLine):
+        """Return the test described by line if it matches regex.  Tests with
+        docstrings put "test (module.Class)" on the line before, which we
+        prefer since it can be addressed.
+        """
+        m = regex.match(self._VERBOSE_PREFIX.sub('', line, 1))
+        if m is None:
+            return None
+        test = m.group(1)
+        if lastLine is not None and self._getTestAddress(test) is None:
+            lastLine = self._VERBOSE_PREFIX.sub('', lastLine, 1)
+            if self._getTestAddress(lastLine) is not None:
+                return lastLine
+        return test
+
+
+    def _processOutput(self, output):
+        """Echo nose's output and, in verbose mode, track which test is
+        running and which have failed for the watchdog.
+        """
+        self.writeOutput(output, end = '')
+        self._allOutput += output
+        lines = self._allOutput.split('\n')
+        self._allOutput = lines.pop()
+        for line in lines:
+            test = self._parseVerboseLine(self._VERBOSE_RESULT, line,
+                    self._lastLine)
+            if test is not None:
+                if self._VERBOSE_FAILURE.search(line):
+                    testAddress = self._getTestAddress(test)
+                    if testAddress is not None:
+                        self._outputFailures.append(testAddress)
+                self._runningTest = None
+                self._testFinished()
+            self._lastLine = line
+
+        test = self._parseVerboseLine(self._VERBOSE_START, self._allOutput,
+                self._lastLine)
+        if test is not None and test != self._runningTest:
+            self._runningTest = test
+            self._testStarted(test)
+
+
+    def _recordTimeout(self, timedOutTest, message):
+        """The .noseids file is not written for a killed nosetests, so record
+        the failures we saw in its output along with timedOutTest.
+        """
+        self.writeOutput("\n{0} ... TIMEOUT ({1})".format(timedOutTest,
+                message))
+        testAddress = self._getTestAddress(timedOutTest)
+        if testAddress is not None:
+            self._outputFailures.append(testAddress)
+        for module, testspec in self._outputFailures:
+            self.failures.setdefault(module, []).append(testspec)
+        self._outputFailures = []
+
+
+    def _removeIdsFile(self):
+        """Remove the .noseids file, which a killed nosetests never rewrites,
+        so that a later read only sees failures from the last full run.
+        """
+        try:
+            os.remove(self._noseIdsFile)
+        except OSError:
+            pass
+
+
+    def _startProcessOutput(self):
+        """Reset our output parsing state for a new nosetests process."""
+        self._allOutput = ""
+        self._lastLine = None
+        self._runningTest = None
+        self._outputFailures = []